@@ -5,22 +5,22 @@ import json
 from datetime import date, timedelta, datetime
 import shutil
 import logging
-from pathlib import Path
+import sys
+from functools import lru_cache
 
 import os
 from re_data.templating import render
 from re_data.include import OVERVIEW_INDEX_FILE_PATH
-from http.server import SimpleHTTPRequestHandler
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 import webbrowser
-from socketserver import TCPServer
 from re_data.version import check_version, with_version_check
 from yachalk import chalk
-import yaml
 from re_data.notifications.slack import slack_notify, generate_slack_message, generate_all_good_slack_message
-from re_data.notifications.email import send_mime_email, build_mime_message
+from re_data.notifications.email import open_smtp_connection, send_mime_email, build_mime_message
 from re_data.utils import (
     parse_dbt_vars, load_metadata_from_project, normalize_re_data_json_export,
-    get_project_root
+    get_project_root, load_yaml_file, load_json_file, get_re_data_version,
+    copy_file, dump_dbt_vars
 )
 
 from re_data.notifications.utils import build_notification_identifiers_per_model, prepare_exported_alerts_per_model, validate_alert_types, ALERT_TYPES, create_owners_to_models_map, create_models_to_alerts_map
@@ -39,18 +39,61 @@ def add_options(options):
         return func
     return _add_options
 
-def add_dbt_flags(command_list, flags):
+def get_dbt_flags(flags):
+    flag_args = []
     for key, value in flags.items():
         # exclude the --dbt-vars flag, as it's not a valid dbt flag
         if value and key != 'dbt_vars':
             key = key.replace('_', '-')
-            command_list.extend([f'--{key}', value])
-    print(' '.join(command_list))
+            flag_args.extend([f'--{key}', value])
+    return flag_args
+
+def log_dbt_command(command_list):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s', ' '.join(command_list))
+
+def add_dbt_flags(command_list, flags):
+    command_list.extend(get_dbt_flags(flags))
+    log_dbt_command(command_list)
+
+@lru_cache(maxsize=None)
+def get_dbt_executable():
+    # resolved once, falls back to the bare name so a missing dbt fails as before
+    return shutil.which('dbt') or 'dbt'
+
+def run_dbt_command(command_list):
+    # CPython only spawns with posix_spawn (instead of fork + exec) when the executable is given as a path
+    # and close_fds is off. our file descriptors are non-inheritable (PEP 446), so they don't leak into dbt
+    return subprocess.run([get_dbt_executable()] + command_list[1:], close_fds=False)
+
+def get_dbt_runner():
+    try:
+        from dbt.cli.main import dbtRunner
+    except ImportError:
+        # programmatic invocations are only available since dbt-core 1.5
+        return None
+    return dbtRunner()
+
+def is_overview_up_to_date(metadata_path, generated_paths, source_paths, re_data_args, version):
+    # metadata.json is written last, so it's only newer than the sources if the previous generate completed after they changed
+    try:
+        if not all(os.path.exists(path) for path in generated_paths):
+            return False
+        if os.stat(metadata_path).st_mtime <= max(os.stat(path).st_mtime for path in source_paths):
+            return False
+    except FileNotFoundError:
+        return False
+    try:
+        metadata = load_json_file(metadata_path)
+    except ValueError:
+        # e.g. a truncated file, the overview is regenerated and the file rewritten
+        return False
+    return metadata.get('re_data_args') == re_data_args and metadata.get('version') == version
 
 def get_target_paths(kwargs, re_data_target_dir=None):
     project_root = get_project_root(kwargs)
     
-    project_dict = yaml.safe_load(Path(os.path.join(project_root, 'dbt_project.yml')).read_text())
+    project_dict = load_yaml_file(os.path.join(project_root, 'dbt_project.yml'))
 
     dbt_target_path = os.path.join(
                         project_root,
@@ -114,8 +157,22 @@ dbt_flags = [
 ]
 
 @click.group(help=f"re_data CLI")
-def main():
-    pass
+@click.option(
+    '--debug',
+    is_flag=True,
+    envvar='RE_DATA_DEBUG',
+    help="""
+        Show debug logs, including the dbt commands executed by re_data.
+        Can also be enabled with the RE_DATA_DEBUG environment variable
+    """
+)
+def main(debug):
+    if debug:
+        re_data_logger = logging.getLogger('re_data')
+        re_data_logger.setLevel(logging.DEBUG)
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        re_data_logger.addHandler(handler)
 
 
 @main.command()
@@ -153,9 +210,9 @@ def detect(**kwargs):
 
     dbt_vars = parse_dbt_vars(kwargs.get('dbt_vars'))
     run_list = ['dbt', 'run', '--models', 're_data_columns', 're_data_monitored']
-    if dbt_vars: run_list.extend(['--vars', yaml.dump(dbt_vars)])
+    if dbt_vars: run_list.extend(['--vars', dump_dbt_vars(dbt_vars)])
     add_dbt_flags(run_list, kwargs)
-    completed_process = subprocess.run(run_list)
+    completed_process = run_dbt_command(run_list)
     completed_process.check_returncode()
 
     print(f"Detecting tables", "SUCCESS")
@@ -206,28 +263,42 @@ def run(start_date, end_date, interval, full_refresh, **kwargs):
     else:
         raise Exception(f"Unsupported time grain {time_grain}")
 
+    # reuse a single dbt runner for all intervals to pay dbt's startup cost only once
+    dbt_runner = get_dbt_runner()
+
+    # only the --vars value changes between intervals, so the command is built once
+    run_list = ['dbt', 'run', '--models', 'package:re_data', '--vars', None] + get_dbt_flags(kwargs)
+    vars_index = run_list.index('--vars') + 1
+
     while for_date < end_date:
+        window_end = for_date + delta
 
         start_str = for_date.strftime("%Y-%m-%d %H:%M")
-        end_str = (for_date + delta).strftime("%Y-%m-%d %H:%M")
+        end_str = window_end.strftime("%Y-%m-%d %H:%M")
         print(f"Running for time interval: {start_str} - {end_str}", "RUN")
 
         re_data_dbt_vars = {
             're_data:time_window_start': str(for_date),
-            're_data:time_window_end': str(for_date + delta)
+            're_data:time_window_end': str(window_end)
         }
         dbt_vars.update(re_data_dbt_vars)
 
-        run_list = ['dbt'] + ['run'] + ['--models'] + ['package:re_data'] + ['--vars'] + [json.dumps(dbt_vars)]
-        if for_date == start_date and full_refresh:
-            run_list.append('--full-refresh')
+        run_list[vars_index] = dump_dbt_vars(dbt_vars)
+        command_list = run_list + ['--full-refresh'] if for_date == start_date and full_refresh else run_list
+        log_dbt_command(command_list)
 
-        add_dbt_flags(run_list, kwargs)
+        if dbt_runner:
+            result = dbt_runner.invoke(command_list[1:])
+            # usage errors and dbt crashes are returned on the result instead of being raised
+            if result.exception is not None:
+                raise result.exception
+            if not result.success:
+                raise subprocess.CalledProcessError(1, command_list)
+        else:
+            completed_process = run_dbt_command(command_list)
+            completed_process.check_returncode()
 
-        completed_process = subprocess.run(run_list)
-        completed_process.check_returncode()
-
-        for_date += delta
+        for_date = window_end
 
         print(
             f"Running for date: {for_date.date()}",
@@ -282,7 +353,8 @@ def notify():
     '--force',
     type=click.BOOL,
     help="""
-        Forced to pass some processes if true
+        Forced to pass some processes if true,
+        also regenerates the overview even if it's up to date
     """
 )
 @add_options(dbt_flags)
@@ -297,74 +369,114 @@ def generate(start_date, end_date, interval, re_data_target_dir, force, **kwargs
     tests_history_path = os.path.join(re_data_target_path, 'tests_history.json')
     table_samples_path = os.path.join(re_data_target_path, 'table_samples.json')
     dbt_vars = parse_dbt_vars(kwargs.get('dbt_vars'))
-    metadata = load_metadata_from_project(start_date, end_date, interval, kwargs)
     monitored_path = os.path.join(re_data_target_path, 'monitored.json')
+    re_data_manifest = os.path.join(re_data_target_path, 'dbt_manifest.json')
+    target_file_path = os.path.join(re_data_target_path, 'index.html')
 
-    args = {
-        'start_date': start_date,
-        'end_date': end_date,
-        'interval': interval,
-        'overview_path': overview_path,
-        'monitored_path': monitored_path,
-    }
-    command_list = ['dbt', 'run-operation', 'generate_overview', '--args', yaml.dump(args)]
-    if dbt_vars: command_list.extend(['--vars', yaml.dump(dbt_vars)])
-    add_dbt_flags(command_list, kwargs)
-    completed_process = subprocess.run(command_list)
-    completed_process.check_returncode()
-
-    # export tests history
-    tests_history_args = {
-        'start_date': start_date,
-        'end_date': end_date,
-        'tests_history_path': tests_history_path
-    }
-    tests_history_command_list = ['dbt', 'run-operation', 'export_tests_history', '--args', yaml.dump(tests_history_args)]
-    if dbt_vars: tests_history_command_list.extend(['--vars', yaml.dump(dbt_vars)])
-    add_dbt_flags(tests_history_command_list, kwargs)
-    th_completed_process = subprocess.run(tests_history_command_list)
-    th_completed_process.check_returncode()
-
-    # export table samples
-    table_samples_args = {
-        'start_date': start_date,
-        'end_date': end_date,
-        'table_samples_path': table_samples_path
-    }
-    table_samples_command_list = ['dbt', 'run-operation', 'export_table_samples', '--args', yaml.dump(table_samples_args)]
-    if dbt_vars: table_samples_command_list.extend(['--vars', yaml.dump(dbt_vars)])
-    add_dbt_flags(table_samples_command_list, kwargs)
-    ts_completed_process = subprocess.run(table_samples_command_list)
-    ts_completed_process.check_returncode()
+    # dbt writes run_results.json on every run/test, which is when the exported data can change.
+    # dbt vars, profile, target and profiles dir aren't recorded in metadata.json,
+    # so with any of them the overview is always regenerated
+    if force is not True and not (dbt_vars or kwargs.get('profile') or kwargs.get('target') or kwargs.get('profiles_dir')):
+        project_root = get_project_root(kwargs)
+        # profiles.yml locations dbt looks at, a change there may point the default target to another warehouse
+        profiles_paths = [
+            os.path.join(profiles_dir, 'profiles.yml')
+            for profiles_dir in (os.getenv('DBT_PROFILES_DIR'), project_root, os.path.join(os.path.expanduser('~'), '.dbt'))
+            if profiles_dir
+        ]
+        run_results_path = os.path.join(dbt_target_path, 'run_results.json')
+        up_to_date = is_overview_up_to_date(
+            metadata_path=metadata_path,
+            generated_paths=[
+                overview_path, monitored_path, tests_history_path, table_samples_path, re_data_manifest, target_file_path
+            ],
+            source_paths=[
+                run_results_path,
+                os.path.join(project_root, 'dbt_project.yml'),
+                os.path.join(project_root, 'packages.yml'),
+            ] + [path for path in profiles_paths if os.path.exists(path)],
+            re_data_args={'start_date': start_date, 'end_date': end_date, 'interval': interval},
+            version=get_re_data_version(),
+        )
+        if up_to_date:
+            run_results_time = datetime.fromtimestamp(os.stat(run_results_path).st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+            print(
+                f"Overview is up to date: it was generated with the same arguments after {run_results_path} "
+                f"was last modified ({run_results_time}) and dbt_project.yml, packages.yml and profiles.yml didn't change since. "
+                f"If re_data models were updated elsewhere (e.g. dbt Cloud), use --force true to regenerate it",
+                chalk.green("SUCCESS")
+            )
+            return
 
-    # write metadata to re_data target path
-    with open(metadata_path, 'w+', encoding='utf-8') as f:
-        json.dump(metadata, f)
+    metadata = load_metadata_from_project(start_date, end_date, interval, kwargs)
+    # serialized once, it's passed to every dbt command below
+    dbt_vars_arg = dump_dbt_vars(dbt_vars) if dbt_vars else None
+
+    # the artefacts are about to be overwritten, metadata.json is only written back once all of them are complete
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+
+    # dbt_re_data macros exporting the overview page data, each is executed as a separate run-operation
+    export_operations = [
+        ('generate_overview', {
+            'start_date': start_date,
+            'end_date': end_date,
+            'interval': interval,
+            'overview_path': overview_path,
+            'monitored_path': monitored_path,
+        }),
+        ('export_tests_history', {
+            'start_date': start_date,
+            'end_date': end_date,
+            'tests_history_path': tests_history_path
+        }),
+        ('export_table_samples', {
+            'start_date': start_date,
+            'end_date': end_date,
+            'table_samples_path': table_samples_path
+        }),
+    ]
+    for macro_name, macro_args in export_operations:
+        command_list = ['dbt', 'run-operation', macro_name, '--args', json.dumps(macro_args)]
+        if dbt_vars_arg: command_list.extend(['--vars', dbt_vars_arg])
+        add_dbt_flags(command_list, kwargs)
+        completed_process = run_dbt_command(command_list)
+        completed_process.check_returncode()
 
-    # run dbt docs generate to generate the a full manifest that contains compiled_path etc
+    # run dbt docs generate to generate the a full manifest that contains compiled_path etc.
+    # it runs after the exports, dbt processes of the same project share the target directory
     dbt_docs = ['dbt', 'docs', 'generate']
-    if dbt_vars: dbt_docs.extend(['--vars', yaml.dump(dbt_vars)])
+    if dbt_vars_arg: dbt_docs.extend(['--vars', dbt_vars_arg])
     add_dbt_flags(dbt_docs, kwargs)
-    dbt_docs_process = subprocess.run(dbt_docs)
+    dbt_docs_process = run_dbt_command(dbt_docs)
     if force is not True:
         dbt_docs_process.check_returncode()
 
     dbt_manifest_path = os.path.join(dbt_target_path, 'manifest.json')
-    re_data_manifest = os.path.join(re_data_target_path, 'dbt_manifest.json')
-    shutil.copyfile(dbt_manifest_path, re_data_manifest)
+    copy_file(dbt_manifest_path, re_data_manifest)
 
-    target_file_path = os.path.join(re_data_target_path, 'index.html')
-    shutil.copyfile(OVERVIEW_INDEX_FILE_PATH, target_file_path)
+    copy_file(OVERVIEW_INDEX_FILE_PATH, target_file_path)
 
     normalize_re_data_json_export(overview_path)
     normalize_re_data_json_export(tests_history_path)
     normalize_re_data_json_export(table_samples_path)
 
+    # write metadata to re_data target path, it's written last to mark the overview as complete
+    with open(metadata_path, 'w+', encoding='utf-8') as f:
+        json.dump(metadata, f)
+
     print(
         f"Generating overview page", chalk.green("SUCCESS")
     )
 
 
+class SendfileHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def copyfile(self, source, outputfile):
+        # socket.sendfile uses os.sendfile where available so the file is copied by the kernel,
+        # otherwise it falls back to regular sends
+        self.connection.sendfile(source)
+
+
 @click.option(
     '--port',
     type=click.INT,
@@ -392,7 +504,8 @@ def serve(port, re_data_target_dir, no_browser, **kwargs):
 
     address = '0.0.0.0'
 
-    httpd = TCPServer((address, port), SimpleHTTPRequestHandler)
+    # the UI fetches its json artefacts in parallel, so requests are handled in separate threads
+    httpd = ThreadingHTTPServer((address, port), SendfileHTTPRequestHandler)
 
     if not no_browser:
         try:
@@ -469,7 +582,7 @@ def slack(start_date, end_date, webhook_url, subtitle, re_data_target_dir, selec
     validate_alert_types(selected_alert_types=select)
     start_date = str(start_date.date())
     end_date = str(end_date.date())
-    selected_alert_types = set(select)
+    selected_alert_types = frozenset(select)
 
     if not webhook_url: # if webhook_url is via arguments, check the config file
         config = read_re_data_config()
@@ -489,19 +602,14 @@ def slack(start_date, end_date, webhook_url, subtitle, re_data_target_dir, selec
         'monitored_path': monitored_path,
     }
 
-    command_list = ['dbt', 'run-operation', 'export_alerts', '--args', yaml.dump(args)]
-    if dbt_vars: command_list.extend(['--vars', yaml.dump(dbt_vars)])
+    command_list = ['dbt', 'run-operation', 'export_alerts', '--args', json.dumps(args)]
+    if dbt_vars: command_list.extend(['--vars', dump_dbt_vars(dbt_vars)])
     add_dbt_flags(command_list, kwargs)
-    completed_process = subprocess.run(command_list)
+    completed_process = run_dbt_command(command_list)
     completed_process.check_returncode()
 
-    normalize_re_data_json_export(alerts_path)
-    normalize_re_data_json_export(monitored_path)
-
-    with open(alerts_path) as f:
-        alerts = json.load(f)
-    with open(monitored_path) as f:
-        monitored = json.load(f)
+    alerts = normalize_re_data_json_export(alerts_path)
+    monitored = normalize_re_data_json_export(monitored_path)
 
     slack_members = build_notification_identifiers_per_model(monitored_list=monitored, channel='slack')
 
@@ -566,7 +674,7 @@ def slack(start_date, end_date, webhook_url, subtitle, re_data_target_dir, selec
 @with_version_check
 def email(start_date, end_date, re_data_target_dir, select, send_all_good, **kwargs):
     validate_alert_types(selected_alert_types=select)
-    selected_alert_types = set(select)
+    selected_alert_types = frozenset(select)
     config = read_re_data_config()
     validate_config_section(config, 'email')
     email_config = config.get('notifications').get('email')
@@ -594,50 +702,57 @@ def email(start_date, end_date, re_data_target_dir, select, send_all_good, **kwa
     }
 
 
-    command_list = ['dbt', 'run-operation', 'export_alerts', '--args', yaml.dump(args)]
-    if dbt_vars: command_list.extend(['--vars', yaml.dump(dbt_vars)])
+    command_list = ['dbt', 'run-operation', 'export_alerts', '--args', json.dumps(args)]
+    if dbt_vars: command_list.extend(['--vars', dump_dbt_vars(dbt_vars)])
     add_dbt_flags(command_list, kwargs)
-    completed_process = subprocess.run(command_list)
+    completed_process = run_dbt_command(command_list)
     completed_process.check_returncode()
 
-    with open(alerts_path) as f:
-        alerts = json.load(f)
-    with open(monitored_path) as f:
-        monitored = json.load(f)
+    alerts = load_json_file(alerts_path)
+    monitored = load_json_file(monitored_path)
 
     email_to_models_map = create_owners_to_models_map(monitored_models=monitored)
     model_to_alerts_map = create_models_to_alerts_map(alerts, selected_alert_types)
 
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    for email in email_to_models_map:
-        # get list of models that have no owners
-        models_with_no_owners = email_to_models_map.get('NO_OWNER') or []
-        
-        if email != 'NO_OWNER':
-            models_to_notify = email_to_models_map.get(email)
-            all_models = set(models_to_notify + models_with_no_owners)
-            # if there are no alerts within the time window and flag is set to not notify in such case
-            if len(model_to_alerts_map) == 0 and not send_all_good:
-                break
-            mime_msg = build_mime_message(
-                mail_from=mail_from,
-                mail_to=email,
-                subject='ReData Alerts [{}]'.format(current_time),
-                html_content=render.render_email_alert(alerts=model_to_alerts_map, owner=email, models_to_notify=all_models),
-            )
-
-            send_mime_email(
-                mime_msg=mime_msg,
-                mail_from=mail_from,
-                mail_to=email,
-                smtp_host=smtp_host,
-                smtp_port=smtp_port,
-                smtp_user=smtp_user,
-                smtp_password=smtp_password,
-                use_ssl=use_ssl,
-                use_tls=use_tls
-            )
+    subject = 'ReData Alerts [{}]'.format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    # models that have no owners are included in every owner's notification
+    models_with_no_owners = frozenset(email_to_models_map.get('NO_OWNER') or [])
+    # if there are no alerts within the time window and flag is set to not notify in such case
+    should_notify = len(model_to_alerts_map) > 0 or send_all_good
+
+    recipients = [email for email in email_to_models_map if email != 'NO_OWNER'] if should_notify else []
+    # the email content only depends on which alerted models it includes,
+    # so owners notified about the same alerted models share the rendered html
+    rendered_alerts = {}
+
+    if recipients:
+        # a single connection is used for all recipients instead of reconnecting for every email
+        with open_smtp_connection(
+            smtp_host=smtp_host,
+            smtp_port=smtp_port,
+            smtp_user=smtp_user,
+            smtp_password=smtp_password,
+            use_ssl=use_ssl,
+            use_tls=use_tls
+        ) as server:
+            for email in recipients:
+                all_models = models_with_no_owners.union(email_to_models_map[email])
+                alerted_models = all_models.intersection(model_to_alerts_map)
+                if alerted_models not in rendered_alerts:
+                    rendered_alerts[alerted_models] = render.render_email_alert(alerts=model_to_alerts_map, owner=email, models_to_notify=all_models)
+                mime_msg = build_mime_message(
+                    mail_from=mail_from,
+                    mail_to=email,
+                    subject=subject,
+                    html_content=rendered_alerts[alerted_models],
+                )
+
+                send_mime_email(
+                    mime_msg=mime_msg,
+                    mail_from=mail_from,
+                    mail_to=email,
+                    server=server
+                )
 
     log_notification_status(start_date, end_date, model_to_alerts_map)
 
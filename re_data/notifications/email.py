@@ -32,29 +32,24 @@ def build_mime_message(
     return mime_msg
 
 
-def send_mime_email(
-        mime_msg: MIMEMultipart,
-        mail_from: str,
-        mail_to: str,
+def open_smtp_connection(
         smtp_host: str,
         smtp_port: int,
         smtp_user: str,
         smtp_password: str,
         use_ssl: bool = True,
         use_tls: bool = False
-    ):
+    ) -> smtplib.SMTP:
     """
-    Send an email using the provided MIME message.
+    Open a connection to the SMTP server, it can be reused to send multiple emails.
 
-    :param mime_msg: MIME message to send
-    :param mail_from: Email address to set as the email's from
-    :param mail_to: Email address to set as the email's to
     :param smtp_host: SMTP server to use
     :param smtp_port: SMTP port to use
     :param smtp_user: SMTP user to use
     :param smtp_password: SMTP password to use
     :param use_ssl: Use SSL to connect to SMTP server
     :param use_tls: Use TLS to connect to SMTP server
+    :return: Connected SMTP client
     """
 
     if use_tls:
@@ -66,5 +61,21 @@ def send_mime_email(
         server = smtplib.SMTP(smtp_host, smtp_port)
     if smtp_user and smtp_password:
         server.login(smtp_user, smtp_password)
+    return server
+
+
+def send_mime_email(
+        mime_msg: MIMEMultipart,
+        mail_from: str,
+        mail_to: str,
+        server: smtplib.SMTP
+    ):
+    """
+    Send an email using the provided MIME message.
+
+    :param mime_msg: MIME message to send
+    :param mail_from: Email address to set as the email's from
+    :param mail_to: Email address to set as the email's to
+    :param server: SMTP client returned by open_smtp_connection
+    """
     server.sendmail(mail_from, mail_to, mime_msg.as_string())
-    server.quit()
@@ -3,7 +3,7 @@ from collections import defaultdict
 import json
 from click import BadOptionUsage
 
-ALERT_TYPES = {'anomaly', 'schema_change', 'test'}
+ALERT_TYPES = frozenset({'anomaly', 'schema_change', 'test'})
 
 def build_notification_identifiers_per_model(monitored_list: list, channel) -> Dict[str, Tuple[str, str]]:
     """
@@ -13,6 +13,10 @@ except ImportError:
     import importlib_metadata as metadata # python<=3.7
 
 analytics.write_key = 'ROINJZvn7ksDkALq7IKFtErKvaPGvqd2'
+# events are uploaded by analytics' background thread, but its queue is joined at exit.
+# keep that upload short and don't retry, so usage stats never noticeably delay a command
+analytics.timeout = 1
+analytics.max_retries = 0
 
 def initialize_tracker():
     if flags.SEND_ANONYMOUS_USAGE_STATS:
@@ -1,7 +1,9 @@
 from typing import Any, Dict, Optional, List, Tuple
+from collections import OrderedDict
 from datetime import datetime, timezone
 import json
 import os
+import shutil
 from pathlib import Path
 import pkg_resources
 import yaml
@@ -13,16 +15,46 @@ except ImportError:
     from yaml import ( 
         SafeLoader
     )
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# parsed yaml files keyed by absolute path, validated against (st_mtime, st_size)
+_yaml_cache: 'OrderedDict[str, Tuple[float, int, Any]]' = OrderedDict()
+_YAML_CACHE_MAX_ENTRIES = 100
+
+
+def load_yaml_file(path: str) -> Any:
+    """
+    Load a yaml file, reusing the previously parsed content if the file hasn't changed.
+    The returned object is shared between callers and must not be mutated.
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    cached = _yaml_cache.get(abs_path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        _yaml_cache.move_to_end(abs_path)
+        return cached[2]
+
+    content = safe_load(Path(abs_path).read_text())
+    _yaml_cache[abs_path] = (stat.st_mtime, stat.st_size, content)
+    if len(_yaml_cache) > _YAML_CACHE_MAX_ENTRIES:
+        _yaml_cache.popitem(last=False)
+    return content
 
 
 def get_project_root(kwargs):
     return os.getcwd() if not kwargs.get('project_dir') else os.path.abspath(kwargs['project_dir'])
 
+def get_re_data_version() -> str:
+    return pkg_resources.require("re_data")[0].version
+
 def load_metadata_from_project(start_date, end_date, interval, kwargs) -> Dict:
-    project_root = os.getcwd() if not kwargs.get('project_dir') else os.path.abspath(kwargs['project_dir'])
-    project_dict = yaml.safe_load(Path(os.path.join(project_root, 'dbt_project.yml')).read_text())
-    packages_dict = yaml.safe_load(Path(os.path.join(project_root, 'packages.yml')).read_text())
-    version = pkg_resources.require("re_data")[0].version
+    project_root = get_project_root(kwargs)
+    project_dict = load_yaml_file(os.path.join(project_root, 'dbt_project.yml'))
+    packages_dict = load_yaml_file(os.path.join(project_root, 'packages.yml'))
+    version = get_re_data_version()
     metadata = {
         'project_dict': project_dict,
         'packages': packages_dict,
@@ -36,18 +68,58 @@ def load_metadata_from_project(start_date, end_date, interval, kwargs) -> Dict:
     }
     return metadata
 
-def normalize_re_data_json_export(path: str):
+def copy_file(src: str, dst: str):
     """
-    Normalize the data exported from Re.
+    Copy a file with copy_file_range where available, which lets the kernel
+    clone it on filesystems supporting reflinks, and shutil.copyfile otherwise.
     """
-    with open(path, 'r') as f:
-        json_data = json.load(f)
+    # files reporting no size (e.g. in /proc) may still have content, so they are copied by shutil
+    if hasattr(os, 'copy_file_range') and os.stat(src).st_size > 0:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        # some FUSE, overlay and NFS setups report 0 before the end of the file
+                        raise OSError('copy_file_range stopped before the end of {}'.format(src))
+                    remaining -= copied
+            return
+        except OSError:
+            # e.g. unsupported by the kernel or filesystem, the regular copy below overwrites dst
+            pass
+    shutil.copyfile(src, dst)
+
+def load_json_file(path: str) -> Any:
+    """
+    Load a json file, using orjson when it's installed.
+    """
+    content = Path(path).read_bytes()
+    if orjson:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN/Infinity, which dbt's tojson writes for non-finite floats
+            pass
+    return json.loads(content)
+
+def dump_json_file(path: str, data: Any):
+    """
+    Write data to a json file. The stdlib json module is used as orjson would write NaN/Infinity as null.
+    """
+    Path(path).write_text(json.dumps(data), encoding='utf-8')
+
+def normalize_re_data_json_export(path: str) -> List[Dict[str, Any]]:
+    """
+    Normalize the data exported from Re and return the normalized data.
+    """
+    json_data = load_json_file(path)
     
     normalized_json_data = [{k.lower(): v for k, v in data.items()} for data in json_data]
 
     # overwrite the original file with the normalized data
-    with open(path, 'w+', encoding='utf-8') as f:
-        json.dump(normalized_json_data, f)
+    dump_json_file(path, normalized_json_data)
+    return normalized_json_data
 
 def parse_dbt_vars(dbt_vars_string) -> Dict[str, Any]:
     dbt_vars = {}
@@ -58,5 +130,9 @@ def parse_dbt_vars(dbt_vars_string) -> Dict[str, Any]:
             raise ValueError('The --dbt-vars argument expected a yaml dictionary, but got {}'.format(content_type.__name__))
     return dbt_vars
 
+def dump_dbt_vars(dbt_vars: Dict[str, Any]) -> str:
+    # yaml parsed vars may contain dates and timestamps, which are passed to dbt as strings
+    return json.dumps(dbt_vars, default=str)
+
 def safe_load(content) -> Optional[Dict[str, Any]]:
     return yaml.load(content, Loader=SafeLoader)
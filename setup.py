@@ -37,7 +37,10 @@ setup(
         "analytics-python",
         
     ],
-    extras_require={"dev": ["isort", "black", "pre-commit"]},
+    extras_require={
+        "dev": ["isort", "black", "pre-commit"],
+        "fast": ["orjson"],
+    },
     entry_points={
         "console_scripts": ["re_data=re_data.command_line:main"],
     },